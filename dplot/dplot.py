@@ -1,19 +1,20 @@
+import asyncio
+import atexit
 import enum
+import hashlib
+import itertools
 import math
 import os.path
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from itertools import chain
-from typing import Union, Literal, get_args, Collection, cast
+from typing import Union, Literal, get_args, Collection, cast, Callable
 import numpy as np
 
-# import matplotlib
-# matplotlib.use('gtk3agg')
-import matplotlib.pyplot as plt
-
 # https://tikz.dev/pgfplots/reference-markers
 
 
@@ -31,6 +32,16 @@ Marker = Literal[
     'triangle*', 'diamond', 'diamond*', 'halfdiamond*', 'halfsquare*', 'halfsquare left*', 'halfsquare right*', 'Mercedes star', 'Mercedes star flipped',
     'halfcircle', 'halfcircle*', 'pentagon', 'pentagon*', 'ball', 'cube', 'cube*', '']
 
+# precomputed axis lookups, avoids the Literal introspection of get_args on every call
+_X_AXES: tuple[XAxis, ...] = get_args(XAxis)
+_Y_AXES: tuple[YAxis, ...] = get_args(YAxis)
+_ALL_AXES = _X_AXES + _Y_AXES  # keeps the declaration order
+_AXIS_KIND = {'t': 'x', 'b': 'x', 'l': 'y', 'r': 'y'}
+_OPPOSITE_AXIS_KIND = {'x': 'y', 'y': 'x'}
+_OPPOSITE_AXIS = {'l': 'r', 'r': 'l', 't': 'b', 'b': 't'}
+_AXIS_POS = {'t': 'top', 'l': 'left', 'r': 'right', 'b': 'bottom'}
+_AXES_TEMPLATE: dict[Union[XAxis, YAxis], Union['AxisSetup', None]] = dict.fromkeys(_ALL_AXES)  # copied for each figure
+
 LatexCmdsDocClass = [r'\documentclass[class=IEEEtran]{standalone}']
 LatexCmdsAfterDocClass = [
     r'\usepackage{tikz,amsmath,siunitx}',
@@ -46,12 +57,82 @@ LatexCmdsAfterDocClass = [
     r'\newlength\figurewidth',
     r'\newlength\figureheight',
 ]
+# marks the end of a precompiled preamble (mylatexformat), expands to \relax if no format is used
+LatexCmdEndOfDump = r'\csname endofdump\endcsname'
 
 
 class Environment:
     PATH_PDFLATEX = 'pdflatex'
     PATH_PDF2SVG = 'pdf2svg'
     PATH_SCOUR = 'scour'
+    SCOUR_MIN_SIZE = 50 * 1024  # svg files below this size (bytes) are not optimized by scour
+    PRECOMPILE_PREAMBLE = False  # compile the preamble once per process into a format, requires mylatexformat
+
+
+def _minmax_numpy(a: np.ndarray) -> tuple[float, float]:
+    # fmin/fmax skip nan samples, an empty or all-nan array yields nan
+    if a.size == 0:
+        return math.nan, math.nan
+    return float(np.fmin.reduce(a)), float(np.fmax.reduce(a))
+
+
+_data_versions = itertools.count()  # unique for every assignment of Data.dx / Data.dy
+
+_format_dir: Union[str, None] = None
+_format_dir_lock = threading.Lock()
+
+
+def _get_format_dir() -> str:
+    # the precompiled preamble formats are kept for the lifetime of the process, removed at interpreter exit
+    global _format_dir
+    with _format_dir_lock:
+        if _format_dir is None:
+            _format_dir = tempfile.mkdtemp(prefix='dplot-')
+            atexit.register(shutil.rmtree, _format_dir, ignore_errors=True)
+        return _format_dir
+
+
+_doc_preambles: dict[tuple[str, ...], str] = {}
+
+
+def _get_doc_preamble() -> str:
+    # the document head up to \begin{document} only changes if the LatexCmds* lists are modified, so it is joined once
+    key = (Environment.PRECOMPILE_PREAMBLE,) + tuple(LatexCmdsDocClass) + tuple(LatexCmdsAfterDocClass)
+    preamble = _doc_preambles.get(key)
+    if preamble is None:
+        # the end of dump marker is only required if the preamble is precompiled
+        end_of_dump = [LatexCmdEndOfDump] if Environment.PRECOMPILE_PREAMBLE else []
+        preamble = '\n'.join(
+            ['%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%', '% auto-generated using dplot %', '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%']
+            + LatexCmdsDocClass + LatexCmdsAfterDocClass + end_of_dump + [r'\begin{document}']
+        )
+        _doc_preambles[key] = preamble
+    return preamble
+
+
+_preamble_formats: dict[str, Union[str, None]] = {}
+_preamble_formats_lock = threading.Lock()
+
+
+def _get_preamble_format(quiet: bool) -> Union[str, None]:
+    """
+    Precompile the (constant) latex preamble into a pdflatex format, so that it is not parsed for each figure again.
+    :param quiet: suppress the output of pdflatex
+    :return: name of the format file in the dplot format directory, None if it could not be created
+    """
+    preamble = LatexCmdsDocClass + LatexCmdsAfterDocClass + [LatexCmdEndOfDump]
+    name = 'dplot-preamble-' + hashlib.sha256('\n'.join(preamble).encode('utf-8')).hexdigest()[:16]
+    with _preamble_formats_lock:
+        if name not in _preamble_formats:
+            path_format_dir = _get_format_dir()
+            with open(os.path.join(path_format_dir, name + '.tex'), 'w') as fp:
+                fp.write('\n'.join(preamble + [r'\begin{document}', r'\end{document}']))
+            cmd = [Environment.PATH_PDFLATEX, '-ini', '-interaction=nonstopmode', f'-jobname={name}', '&pdflatex', 'mylatexformat.ltx', name + '.tex']
+            subprocess.run(cmd, cwd=path_format_dir, stdout=subprocess.DEVNULL if quiet else None, stderr=subprocess.DEVNULL if quiet else None)
+            _preamble_formats[name] = name if os.path.exists(os.path.join(path_format_dir, name + '.fmt')) else None
+            if _preamble_formats[name] is None:
+                print('warning: preamble could not be precompiled, using the regular pdflatex format', file=sys.stderr)
+        return _preamble_formats[name]
 
 
 class ExportType(enum.Enum):
@@ -160,9 +241,18 @@ class LineSetup:
         self.marker: Marker = marker
         self.marker_repeat: int = int(marker_repeat)
         self.marker_phase: int = int(marker_phase)
+        self._latex_header: Union[str, None] = None  # \addplot header formatted by _LatexOutput, reset on any change
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name != '_latex_header':
+            super().__setattr__('_latex_header', None)
 
 
 class Data:
+    # fixed attribute set, cheaper attribute access and smaller instances for figures with many data sets
+    __slots__ = ('ax', 'ay', '_dx', '_dy', '_version', 'label', 'ls', '_id', '_table_cache', '_bounds_cache')
+
     def __init__(
             self,
             ax: XAxis,
@@ -181,20 +271,60 @@ class Data:
         :param label: label string, supports latex
         :param ls: line-setup
         """
-        assert len(dx) == len(dy)
         if ls is None:
             ls = LineSetup()  # apply default line setup
         self.ax = ax
         self.ay = ay
         self.dx = dx
         self.dy = dy
+        assert self.dx.shape == self.dy.shape
         self.label = label
         self.ls = ls
         self._id = None
+        self._table_cache: Union[tuple, None] = None  # (dx, dy, table key, formatted table), see _LatexOutput
+        self._bounds_cache: Union[tuple, None] = None  # (dx, dy, x bounds, y bounds), see _get_bounds
+
+    # dx and dy are stored as private, read-only, contiguous float64 copies, so they can only change by reassignment,
+    # which the caches detect (by identity of the arrays, for the figure by the version)
+    @property
+    def dx(self) -> np.ndarray:
+        return self._dx
+
+    @dx.setter
+    def dx(self, dx: TypeData):
+        self._dx = Data._to_private_array(dx)
+        self._version = next(_data_versions)
+
+    @property
+    def dy(self) -> np.ndarray:
+        return self._dy
+
+    @dy.setter
+    def dy(self, dy: TypeData):
+        self._dy = Data._to_private_array(dy)
+        self._version = next(_data_versions)
+
+    @staticmethod
+    def _to_private_array(values: TypeData) -> np.ndarray:
+        arr = np.array(values, dtype=np.float64, order='C')  # always a copy, later changes of the input do not leak in
+        assert arr.ndim == 1
+        arr.setflags(write=False)
+        return arr
+
+    def _get_bounds(self) -> tuple[tuple[float, float], tuple[float, float]]:
+        # (min, max) of dx and dy, kept as long as the arrays are unchanged, e.g. for data sets shared between figures
+        cache = self._bounds_cache
+        if cache is None or cache[0] is not self.dx or cache[1] is not self.dy:
+            # python floats, the merging in Figure._validate then works without numpy scalar dispatch
+            cache = (self.dx, self.dy, _minmax_numpy(self.dx), _minmax_numpy(self.dy))
+            self._bounds_cache = cache
+        return cache[2], cache[3]
 
     def cfg_marker(self, phase_frac: float = 0.0, n_samples=0, n_markers: int = 5) -> 'Data':
-        if n_samples == 0:
-            n_samples = len(self.dx)
+        # plain python numbers, numpy scalars would route every operation through numpy
+        n_samples = int(n_samples) if n_samples else len(self.dx)
+        n_markers = int(n_markers)
+        phase_frac = float(phase_frac)
         self.ls.marker_repeat = math.floor(n_samples / n_markers)
         self.ls.marker_phase = round((phase_frac % 1) * n_samples / n_markers)
         return self
@@ -204,7 +334,7 @@ class Data:
 class Figure:
     def __init__(self, name: str, title: str = '', width: str = '5cm', height: str = '5cm', basic_thickness: PlotThickness = 'thick',
                  background_color: PlotColor = 'white',
-                 legend_setup: LegendSetup = LegendSetup()):
+                 legend_setup: LegendSetup = LegendSetup(), precision: Union[int, None] = None):
         self.name: str = name
         self.title: str = title
         self.width: str = width
@@ -212,14 +342,19 @@ class Figure:
         self.basic_thickness: PlotThickness = basic_thickness
         self.background_color: PlotColor = background_color
         self.legend_setup = legend_setup
-        self.axes = cast(dict[Union[XAxis, YAxis], AxisSetup], dict([(axis, None) for axis in get_args(XAxis) + get_args(YAxis)]))
+        # significant digits of the written data values, None writes them losslessly (shortest round-trip form)
+        self.precision: Union[int, None] = precision
+        self.axes = cast(dict[Union[XAxis, YAxis], AxisSetup], _AXES_TEMPLATE.copy())
         self.plot_data: list[Data] = []
         self._data_counter = 0
+        self._latex_cache_key = None
+        self._latex_chunks: Union[list[str], None] = None  # the latex document, as written by _LatexOutput
 
     def add(self, data: Data):
         data._id = self._data_counter
         self._data_counter += 1
         self.plot_data.append(data)
+        self._latex_cache_key = None
 
     def plot(
             self,
@@ -235,8 +370,8 @@ class Figure:
         return data
 
     def get_latex_code(self) -> list[str]:
-        self._validate()
-        return _LatexOutput(self).exec()
+        self._update_latex_cache()
+        return ''.join(self._latex_chunks).split('\n')
 
     def export(self, path_out_dir: str, *types, quiet=True):
         types: list[ExportType] = list(types)
@@ -254,15 +389,37 @@ class Figure:
         path_latex = os.path.join(path_out_dir, self.name + '.tex')
         path_pdf = os.path.join(path_out_dir, self.name + '.pdf')
         path_svg = os.path.join(path_out_dir, self.name + '.svg')
+        path_hash = os.path.join(path_out_dir, os.path.dirname(self.name), '.dplot_cache_' + os.path.basename(self.name) + '.sha256')
         os.makedirs(path_out_dir, exist_ok=True)
 
-        if ExportType.LATEX in required_types:
-            with open(path_latex, 'w') as fp:
-                fp.write('\n'.join(self.get_latex_code()))
-        if ExportType.PDF in required_types:
-            self._cvt_latex_to_pdf(path_latex, path_pdf, quiet)
-        if ExportType.SVG in required_types:
-            self._cvt_pdf_to_svg(path_pdf, path_svg, quiet)
+        type_map = {
+            ExportType.LATEX: path_latex,
+            ExportType.PDF: path_pdf,
+            ExportType.SVG: path_svg
+        }
+        paths = tuple([type_map[t] for t in types])
+
+        # skip the export if the requested files were already generated from the same latex code
+        self._update_latex_cache()
+        h = hashlib.sha256()
+        for chunk in self._latex_chunks:
+            h.update(chunk.encode('utf-8'))
+        latex_hash = h.hexdigest()
+        up_to_date = False
+        if os.path.exists(path_hash) and all(os.path.exists(path) for path in paths):
+            with open(path_hash, 'r') as fp:
+                up_to_date = fp.read().strip() == latex_hash
+
+        if not up_to_date:
+            if os.path.exists(path_hash):
+                os.remove(path_hash)  # the outputs are about to change
+            if ExportType.LATEX in required_types:
+                with open(path_latex, 'w', buffering=1 << 20) as fp:
+                    fp.writelines(self._latex_chunks)  # no joined copy of the whole document
+            if ExportType.PDF in required_types:
+                self._cvt_latex_to_pdf(path_latex, path_pdf, quiet)
+            if ExportType.SVG in required_types:
+                self._cvt_pdf_to_svg(path_pdf, path_svg, quiet)
 
         if ExportType.LATEX not in types and os.path.exists(path_latex):
             os.remove(path_latex)
@@ -271,47 +428,128 @@ class Figure:
         if ExportType.SVG not in types and os.path.exists(path_svg):
             os.remove(path_svg)
 
-        type_map = {
-            ExportType.LATEX: path_latex,
-            ExportType.PDF: path_pdf,
-            ExportType.SVG: path_svg
-        }
-        return tuple([type_map[t] for t in types])
+        if not up_to_date:
+            with open(path_hash, 'w') as fp:
+                fp.write(latex_hash)
+        return paths
+
+    async def export_async(self, path_out_dir: str, *types, quiet=True) -> tuple[str, ...]:
+        """
+        Awaitable variant of export(), the export runs in a worker thread, so several figures can be exported
+        concurrently, e.g. with asyncio.gather().
+        """
+        return await asyncio.to_thread(self.export, path_out_dir, *types, quiet=quiet)
+
+    @staticmethod
+    def export_many(figs: Collection['Figure'], path_out_dir: str, *types, quiet=True, jobs: Union[int, None] = None) -> list[tuple[str, ...]]:
+        """
+        Export multiple figures concurrently, one conversion pipeline per figure.
+        :param figs: figures to export, their names must be unique
+        :param path_out_dir: output directory, see export()
+        :param types: export types, see export()
+        :param quiet: suppress the output of the external tools
+        :param jobs: maximum number of figures exported at the same time, defaults to the number of cpus
+        :return: the paths of the exported files for each figure
+        """
+        if len(figs) == 0:
+            return []
+        max_workers = min(len(figs), jobs or os.cpu_count() or 1)
+        # the work is done by the external processes, so threads are sufficient to run them in parallel
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fig.export, path_out_dir, *types, quiet=quiet) for fig in figs]
+            return [future.result() for future in futures]
 
     def show(self):
         _MatplotlibView(self).show()
 
+    def _update_latex_cache(self):
+        key = self._get_latex_cache_key()
+        if key == self._latex_cache_key:
+            # the snapshot is taken after validation, an unchanged figure neither needs validation nor new code
+            return
+        self._validate()
+        key = self._get_latex_cache_key()  # the validation may have filled in auto-detected limits
+        if key != self._latex_cache_key:
+            self._latex_chunks = []
+            _LatexOutput(self).exec(self._latex_chunks.append)
+            self._latex_cache_key = key
+
+    def _get_latex_cache_key(self) -> tuple:
+        # snapshot of everything the latex output depends on, data arrays are compared by their version
+        return (
+            Environment.PRECOMPILE_PREAMBLE,
+            tuple(LatexCmdsDocClass),
+            tuple(LatexCmdsAfterDocClass),
+            self.width,
+            self.height,
+            self.basic_thickness,
+            self.background_color,
+            self.precision,
+            Figure._get_setup_key(self.legend_setup),
+            tuple((axis, Figure._get_setup_key(axis_setup)) for axis, axis_setup in self.axes.items()),
+            tuple((data._id, data.ax, data.ay, data._version, data.label, Figure._get_setup_key(data.ls)) for data in self.plot_data),
+        )
+
+    @staticmethod
+    def _get_setup_key(setup) -> Union[tuple, None]:
+        if setup is None:
+            return None
+        return tuple(
+            (k, Figure._get_setup_key(v) if isinstance(v, (GridSetup, TickSetup)) else v)
+            for k, v in vars(setup).items() if not k.startswith('_')
+        )
+
     def _cvt_latex_to_pdf(self, path_latex: str, path_pdf: str, quiet=True):
         if shutil.which(Environment.PATH_PDFLATEX) is None:
             raise FileNotFoundError(Environment.PATH_PDFLATEX)
 
-        path_tmp_dir = tempfile.mkdtemp()
-        cmd = [Environment.PATH_PDFLATEX, '-synctex=1', '-interaction=nonstopmode', path_latex]
-
-        # 1st latex compilation run
-        proc = subprocess.Popen(cmd, cwd=path_tmp_dir, stdout=subprocess.PIPE, stderr=sys.stdout.buffer)
+        with tempfile.TemporaryDirectory(prefix='dplot-') as path_tmp_dir:
+            # in batch mode pdflatex does not print to the terminal, the messages are then taken from the log file
+            cmd = [Environment.PATH_PDFLATEX, '-synctex=1', '-interaction=batchmode' if quiet else '-interaction=nonstopmode']
+            path_log = os.path.join(path_tmp_dir, os.path.splitext(os.path.basename(path_latex))[0] + '.log')
+            env = None
+            if Environment.PRECOMPILE_PREAMBLE:
+                fmt = _get_preamble_format(quiet)
+                if fmt is not None:
+                    cmd.append(f'-fmt={fmt}')
+                    env = dict(os.environ, TEXFORMATS=_get_format_dir() + os.pathsep)  # trailing separator: keep default paths
+
+            # the legend references the plots via labels, which are only resolved by a 2nd run,
+            # so in that case the 1st run does not need to write a pdf at all
+            draft = self.legend_setup.enable and len(self.plot_data) > 0
+
+            # 1st latex compilation run
+            output = self._run_latex(cmd + (['-draftmode'] if draft else []) + [path_latex], path_tmp_dir, env, quiet, path_log)
+
+            # 2nd latex compilation run, only if required
+            output2 = b''
+            if draft or b'Rerun' in output or b'may have changed' in output:
+                output2 = self._run_latex(cmd + [path_latex], path_tmp_dir, env, quiet, path_log)
+
+            path_tmp_pdf = os.path.join(path_tmp_dir, os.path.basename(path_pdf))
+            if not os.path.exists(path_tmp_pdf):
+                if quiet:  # if quiet, no output so far. Due to that we report all output now,
+                    print((output + output2).decode('utf-8'), end='', flush=True, file=sys.stderr)
+                raise RuntimeError('compilation failed')
+            try:
+                os.replace(path_tmp_pdf, path_pdf)
+            except OSError:  # e.g. different filesystems
+                shutil.copy(path_tmp_pdf, path_pdf)
+
+    def _run_latex(self, cmd: list[str], cwd: str, env: Union[dict[str, str], None], quiet: bool, path_log: str) -> bytes:
         if not quiet:
-            for line in proc.stdout:
-                print(line.decode('utf-8'), end='')
-        proc.wait()
-
-        # 2nd latex compilation run
-        proc2 = subprocess.Popen(cmd, cwd=path_tmp_dir, stdout=subprocess.PIPE, stderr=sys.stdout.buffer)
-        if not quiet:
-            for line in proc2.stdout:
-                print(line.decode('utf-8'), end='')
-        proc2.wait()
-
-        path_tmp_pdf = os.path.join(path_tmp_dir, os.path.basename(path_pdf))
-        if os.path.exists(path_tmp_pdf):
-            shutil.copy(path_tmp_pdf, path_pdf)
-        else:
-            shutil.rmtree(path_tmp_dir)
-            if quiet:  # if quiet, no output so far. Due to that we report all output now,
-                for line in chain(proc.stdout, proc2.stdout):
-                    print(line.decode('utf-8'), end='', flush=True, file=sys.stderr)
-            raise RuntimeError('compilation failed')
-        shutil.rmtree(path_tmp_dir)
+            res = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, check=False)
+            sys.stdout.buffer.write(res.stdout)
+            sys.stdout.buffer.flush()
+            sys.stderr.buffer.write(res.stderr)
+            sys.stderr.buffer.flush()
+            return res.stdout
+        # batch mode, the terminal output is discarded, the log file contains the messages (incl. rerun warnings and errors)
+        res = subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+        if not os.path.exists(path_log):  # e.g. pdflatex could not start, the reason is on stderr
+            return res.stderr
+        with open(path_log, 'rb') as fp:
+            return fp.read()
 
     def _cvt_pdf_to_svg(self, path_pdf: str, path_svg: str, quiet: bool):
         if shutil.which(Environment.PATH_PDF2SVG) is None:
@@ -321,7 +559,10 @@ class Figure:
         cmd = [Environment.PATH_PDF2SVG, path_pdf, path_svg_tmp]
         subprocess.call(cmd, stdout=subprocess.DEVNULL if quiet else sys.stdout.buffer, stderr=subprocess.DEVNULL if quiet else sys.stderr.buffer)
 
-        if shutil.which(Environment.PATH_SCOUR) is None:
+        if os.path.getsize(path_svg_tmp) < Environment.SCOUR_MIN_SIZE or os.environ.get('DPLOT_NO_SCOUR'):
+            # small file or optimization disabled via DPLOT_NO_SCOUR, not worth spawning scour
+            os.rename(path_svg_tmp, path_svg)
+        elif shutil.which(Environment.PATH_SCOUR) is None:
             print('warning: scour not found, skipping svg optimization', file=sys.stderr)
             os.rename(path_svg_tmp, path_svg)
         else:
@@ -331,64 +572,66 @@ class Figure:
 
     @staticmethod
     def get_axis_pos(axis: Union[XAxis, YAxis]) -> Literal['top', 'left', 'right', 'bottom']:
-        if axis == 't':
-            return 'top'
-        elif axis == 'l':
-            return 'left'
-        elif axis == 'r':
-            return 'right'
-        elif axis == 'b':
-            return 'bottom'
-        raise RuntimeError()
+        pos = _AXIS_POS.get(axis)
+        if pos is None:
+            raise RuntimeError()
+        return pos
 
     @staticmethod
     def get_axis_kind(val: Union[XAxis, YAxis]) -> Literal['x', 'y']:
-        return 'x' if val in get_args(XAxis) else ('y' if val in get_args(YAxis) else None)
+        return _AXIS_KIND.get(val)
 
     @staticmethod
     def get_opposite_axis_kind(axis_kind: Literal['x', 'y']) -> Literal['x', 'y']:
-        return 'x' if axis_kind == 'y' else ('y' if axis_kind == 'x' else None)
+        return _OPPOSITE_AXIS_KIND.get(axis_kind)
 
     @staticmethod
     def get_opposite_axis(axis: Union[XAxis, YAxis]) -> Union[XAxis, YAxis]:
-        if axis == 'l':
-            return 'r'
-        elif axis == 'r':
-            return 'l'
-        elif axis == 't':
-            return 'b'
-        elif axis == 'b':
-            return 't'
-        raise RuntimeError(f'invalid axis: {axis}')
+        if axis not in _OPPOSITE_AXIS:
+            raise RuntimeError(f'invalid axis: {axis}')
+        return _OPPOSITE_AXIS[axis]
 
     # noinspection PyTypeChecker
     def _validate(self):
+        # checked here instead of in __init__, the precision may be reassigned
+        assert self.precision is None or (isinstance(self.precision, int) and self.precision >= 1)
+
+        # value range (min, max) of each referenced axis, collected in a single pass over the data sets,
+        # only required for axes without user defined limits
+        auto_axes = {axis for axis, axis_setup in self.axes.items() if axis_setup is not None and axis_setup.limits is None}
+        bounds: dict[Union[XAxis, YAxis], tuple[float, float]] = {}
         for data in self.plot_data:
             # check for unset but referenced axes
             assert self.axes[data.ax] is not None
             assert self.axes[data.ay] is not None
 
-            # check for empty data sets
-            assert len(data.dx) > 0
-            assert len(data.dy) > 0
+            # check for empty data sets and for x and y data of different length, e.g. after a reassignment
+            assert data.dx.size > 0
+            assert data.dy.size > 0
+            assert data.dx.shape == data.dy.shape
 
-        for axis in self.axes.keys():
+            if data.ax not in auto_axes and data.ay not in auto_axes:
+                continue
+            for axis, (mn, mx) in zip((data.ax, data.ay), data._get_bounds()):
+                if axis not in auto_axes or math.isnan(mn):  # nan: data set without any valid sample
+                    continue
+                if axis in bounds:
+                    mn, mx = min(bounds[axis][0], mn), max(bounds[axis][1], mx)
+                bounds[axis] = (mn, mx)
+
+        for axis, axis_setup in self.axes.items():
             # check for illegal axis keys
-            assert axis in get_args(XAxis) or axis in get_args(YAxis)
+            assert axis in _AXIS_KIND
 
             # check for empty axis limits and auto-detect them
-            axis_setup: AxisSetup = self.axes[axis]
             if axis_setup is not None and axis_setup.limits is None:
-                mx = -sys.float_info.min
-                mn = sys.float_info.max
-                for data in self.plot_data:
-                    if data.ax == axis:
-                        mx = max(mx, axis_setup.scale * np.max(data.dx))
-                        mn = min(mn, axis_setup.scale * np.min(data.dx))
-                    if data.ay == axis:
-                        mx = max(mx, axis_setup.scale * np.max(data.dy))
-                        mn = min(mn, axis_setup.scale * np.min(data.dy))
-                axis_setup.limits = (mn, mx)
+                if axis in bounds:
+                    # scale once, a negative scale swaps the bounds
+                    lo, hi = axis_setup.scale * bounds[axis][0], axis_setup.scale * bounds[axis][1]
+                    axis_setup.limits = (min(lo, hi), max(lo, hi))
+                else:
+                    # axis without any data, keep the historic placeholder limits
+                    axis_setup.limits = (sys.float_info.max, -sys.float_info.min)
 
                 if axis_setup.grid.major_enable and not axis_setup.tick.enable:
                     raise RuntimeError('grid_major requires ticks to be enabled')
@@ -404,19 +647,37 @@ class _LatexOutput:
     def __init__(self, fig: Figure):
         self.fig = fig
         self.overscale_limit = 1e10
+        self.table_block_rows = 65536
+        self.__used_axes: list[tuple[Union[XAxis, YAxis], AxisSetup, str, str]] = []
 
-    def exec(self):
-        out = self.__create_doc_begin()
-        out += self.__create_padding()
-        out += self.__create_background()
-        for ax in get_args(XAxis):
-            for ay in get_args(YAxis):
-                out += self.__create_plot_group(ax, ay)
-        out += self.__create_overlay()
+    def exec(self, write: Callable[[str], object]):
+        """
+        Generate the latex document section by section.
+        :param write: receives the document piecewise, e.g. the write method of a file or list.append
+        """
+        # the axes in use and their kinds, resolved once for the padding, background and overlay sections
+        self.__used_axes = [
+            (axis, axis_setup, _AXIS_KIND[axis], _OPPOSITE_AXIS_KIND[_AXIS_KIND[axis]])
+            for axis, axis_setup in self.fig.axes.items() if axis_setup is not None
+        ]
+        write('\n'.join(self.__create_doc_begin()))
+        self.__write(write, self.__create_padding())
+        self.__write(write, self.__create_background())
+        # partition the data sets by their axes in a single pass
+        groups: dict[tuple[XAxis, YAxis], list[Data]] = {}
+        for data in self.fig.plot_data:
+            groups.setdefault((data.ax, data.ay), []).append(data)
+        for ax in _X_AXES:
+            for ay in _Y_AXES:
+                self.__write_plot_group(write, ax, ay, groups.get((ax, ay), []))
+        self.__write(write, self.__create_overlay())
         if self.fig.legend_setup.enable:
-            out += self.__create_legend()
-        out += self.__create_doc_end()
-        return out
+            self.__write(write, self.__create_legend())
+        self.__write(write, self.__create_doc_end())
+
+    def __write(self, write: Callable[[str], object], lines: list[str]):
+        write('\n')
+        write('\n'.join(lines))
 
     def __get_y_domain(self, asy: AxisSetup):
         if asy.limits is None:
@@ -434,20 +695,42 @@ class _LatexOutput:
         return mn, mx
 
     def __fmt_flt(self, x: float) -> str:
-        return f'{x:.20e}'
+        # shortest representation that round-trips exactly, 20 digits exceed the precision of a double anyway
+        return repr(float(x))
+
+    def __fmt_table(self, dx: np.ndarray, dy: np.ndarray) -> str:
+        # one %-format call per block of samples, by default the same number format as __fmt_flt (%r of a python float),
+        # the result is a single multi-line block, one line per sample
+        if self.fig.precision is None:
+            row = '  %r %r'
+        else:
+            row = f'  %.{self.fig.precision}g %.{self.fig.precision}g'  # fewer bytes for pdflatex to parse
+        n, block = len(dx), self.table_block_rows
+        if n <= block:
+            return self.__fmt_table_block(row, dx, dy)
+        # large tables are formatted blockwise, this bounds the size of the intermediate lists and tuples
+        return '\n'.join(self.__fmt_table_block(row, dx[i:i + block], dy[i:i + block]) for i in range(0, n, block))
+
+    def __fmt_table_block(self, row: str, dx: np.ndarray, dy: np.ndarray) -> str:
+        values = np.column_stack((dx, dy)).ravel().tolist()
+        return '\n'.join([row] * len(dx)) % tuple(values)
+
+    def __fmt_params(self, params: list[str]) -> str:
+        # one parameter per line, each terminated by a comma, joined in a single pass
+        return '  ' + ',\n  '.join(params) + ','
+
+    def __fmt_axis_block(self, comment: str, params: list[str]) -> str:
+        return r'\begin{axis}% ' + comment + '\n[\n' + self.__fmt_params(params) + '\n]\n' + r'\end{axis}'
 
     def __create_doc_begin(self) -> list[str]:
-        out = ['%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%']
-        out += ['% auto-generated using dplot %']
-        out += ['%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%']
-        out += LatexCmdsDocClass
-        out += LatexCmdsAfterDocClass
-        out += [r'\begin{document}']
-        out += [r'\setlength\figurewidth{' + self.fig.width + r'}']
-        out += [r'\setlength\figureheight{' + self.fig.height + r'}']
-        out += [r'\begin{tikzpicture}[font=\normalsize]']
-        out += [r'\pgfplotsset{every axis/.append style={' + self.fig.basic_thickness + r'},compat=1.18},']
-        return out
+        # only the sizes and the thickness are figure specific, the preamble itself is joined once
+        return [
+            _get_doc_preamble(),
+            r'\setlength\figurewidth{' + self.fig.width + r'}',
+            r'\setlength\figureheight{' + self.fig.height + r'}',
+            r'\begin{tikzpicture}[font=\normalsize]',
+            r'\pgfplotsset{every axis/.append style={' + self.fig.basic_thickness + r'},compat=1.18},',
+        ]
 
     def __get_axis_param(self, axis_kind: Literal['x', 'y'], axis_setup: Union[AxisSetup, None], limits: Union[None, tuple[float, float]] = None) -> list[str]:
         if limits is None:
@@ -463,15 +746,10 @@ class _LatexOutput:
 
     def __create_padding(self) -> list[str]:
         out = ['']
-        out += ['%%%%%%%%%%%']
-        out += ['% padding %']
-        out += ['%%%%%%%%%%%']
-        for axis in get_args(XAxis) + get_args(YAxis):
-            axis_setup = self.fig.axes[axis]
-            if axis_setup is None:
-                continue
-            axis_kind = Figure.get_axis_kind(axis)
-            axis_kind_op = Figure.get_opposite_axis_kind(axis_kind)
+        out.append('%%%%%%%%%%%')
+        out.append('% padding %')
+        out.append('%%%%%%%%%%%')
+        for axis, axis_setup, axis_kind, axis_kind_op in self.__used_axes:
             params = self.__get_axis_param(axis_kind, axis_setup, limits=(0, 1))
             params += [
                 f'{axis_kind}mode=linear',
@@ -486,25 +764,19 @@ class _LatexOutput:
                 f'{axis_kind}label shift={axis_setup.padding}',
                 f'{axis_kind}ticklabel pos={Figure.get_axis_pos(axis)}',
             ]
-            out += [r'\begin{axis}% ' + f'{axis}-axis', r'['] + [f'  {p},' for p in params] + [r']', r'\end{axis}']
+            out.append(self.__fmt_axis_block(f'{axis}-axis', params))
         return out
 
     def __create_background(self) -> list[str]:
         out = ['']
-        out += ['%%%%%%%%%%%%%%']
-        out += ['% background %']
-        out += ['%%%%%%%%%%%%%%']
+        out.append('%%%%%%%%%%%%%%')
+        out.append('% background %')
+        out.append('%%%%%%%%%%%%%%')
         background_color_applied = False
-        for axis, axis_setup in self.fig.axes.items():
-            if axis_setup is None:
-                continue
-            axis = cast(Union[XAxis, YAxis], axis)
-            axis_setup = cast(AxisSetup, axis_setup)
-            axis_kind = Figure.get_axis_kind(axis)
-            axis_kind_op = Figure.get_opposite_axis_kind(axis_kind)
+        for axis, axis_setup, axis_kind, axis_kind_op in self.__used_axes:
             params = self.__get_axis_param(axis_kind, axis_setup)
             if not background_color_applied:
-                params += [f'axis background/.style={{fill={self.fig.background_color}}}']
+                params.append(f'axis background/.style={{fill={self.fig.background_color}}}')
                 background_color_applied = True
             params += [
                 f'{axis_kind}mode=' + ('log' if axis_setup.log else 'linear'),
@@ -527,24 +799,23 @@ class _LatexOutput:
                 f'minor {axis_kind} tick style={{{axis_setup.tick.minor_thickness},color={axis_setup.tick.minor_color}}}',
                 f'minor {axis_kind} tick num={axis_setup.tick.minor_num}',
             ]
-            out += [r'\begin{axis}% ' + f'{axis}-axis', r'['] + [f'  {p},' for p in params] + [r']', r'\end{axis}']
+            out.append(self.__fmt_axis_block(f'{axis}-axis', params))
         return out
 
-    def __create_plot_group(self, ax: XAxis, ay: YAxis) -> list[str]:
+    def __write_plot_group(self, write: Callable[[str], object], ax: XAxis, ay: YAxis, data_selected: list[Data]):
         out = ['']
-        out += ['%%%%%%%%%%%%%%%%%%']
-        out += [f'% plot group {ax}/{ay} %']
-        out += ['%%%%%%%%%%%%%%%%%%']
-        data_selected = [data for data in self.fig.plot_data if data.ax == ax and data.ay == ay]
+        out.append('%%%%%%%%%%%%%%%%%%')
+        out.append(f'% plot group {ax}/{ay} %')
+        out.append('%%%%%%%%%%%%%%%%%%')
+        self.__write(write, out)
         if len(data_selected) > 0:
-            out += self.__create_plot_begin(ax, ay)
+            self.__write(write, self.__create_plot_begin(ax, ay))
             for data in data_selected:
-                out += self.__create_plot_content(ax, ay, data)
-            out += self.__create_plot_end()
-        return out
+                self.__write_plot_content(write, ax, ay, data)
+            self.__write(write, self.__create_plot_end())
 
     def __create_plot_begin(self, ax: XAxis, ay: YAxis) -> list[str]:
-        asy = cast(AxisSetup, self.fig.axes[ay])
+        asy: AxisSetup = self.fig.axes[ay]
         axis_setup = self.fig.axes[ax]
         params = self.__get_axis_param('x', axis_setup)
         params += [
@@ -559,78 +830,91 @@ class _LatexOutput:
             r'xtick=\empty',
             r'ytick=\empty',
         ]
-        return [r'\begin{axis}', r'['] + [f'  {p},' for p in params] + [r']']
+        return [r'\begin{axis}' + '\n[\n' + self.__fmt_params(params) + '\n]']
 
-    def __create_plot_content(self, ax: XAxis, ay: YAxis, data: Data) -> list[str]:
-        asy = cast(AxisSetup, self.fig.axes[ay])
+    def __write_plot_content(self, write: Callable[[str], object], ax: XAxis, ay: YAxis, data: Data):
+        asy: AxisSetup = self.fig.axes[ay]
         y_domain = self.__get_y_domain(asy)
-        params_plot = [
-            f'color=' + data.ls.plot_color,
-            data.ls.line_style,
-            f'line width={data.ls.line_width}',
-            f'mark={data.ls.marker}',
-            f'mark repeat={data.ls.marker_repeat}',
-            f'mark phase={data.ls.marker_phase}',
-            f'mark options={{solid}}',  # prevent dashed markers etc.
-        ]
-        if len(data.ls.line_style) == 0:
-            params_plot += ['only marks']
-        if len(data.ls.marker) == 0:
-            params_plot += ['no markers']
+        if data.ls._latex_header is None:  # the header only depends on the line setup, shared setups are only formatted once
+            params_plot = [
+                f'color=' + data.ls.plot_color,
+                data.ls.line_style,
+                f'line width={data.ls.line_width}',
+                f'mark={data.ls.marker}',
+                f'mark repeat={data.ls.marker_repeat}',
+                f'mark phase={data.ls.marker_phase}',
+                f'mark options={{solid}}',  # prevent dashed markers etc.
+            ]
+            if len(data.ls.line_style) == 0:
+                params_plot.append('only marks')
+            if len(data.ls.marker) == 0:
+                params_plot.append('no markers')
+            params_table = [
+                f'row sep=newline',
+                f'x index=0',
+                f'y index=1',
+            ]
+            data.ls._latex_header = '\n'.join([r'\addplot [', self.__fmt_params(params_plot), r'] table [', self.__fmt_params(params_table), r']{'])
+
+        asx: AxisSetup = self.fig.axes[ax]
+        self.__write(write, [data.ls._latex_header])
+        # the (large) table is passed to the writer as is, joining it with the other lines would copy it
+        self.__write(write, [self.__get_table(data, asx, asy, y_domain)])
+        self.__write(write, [r'};'])
+        if self.fig.legend_setup.enable:  # the label is only referenced by the legend, it would force a 2nd pdflatex run
+            self.__write(write, [f'\\label{{dplot:{data._id}}}'])
+
+    def __get_table(self, data: Data, asx: AxisSetup, asy: AxisSetup, y_domain: Union[None, tuple[float, float]]) -> str:
+        # the formatted table is kept on the data set and reused as long as the arrays, the scales and the y domain are unchanged
+        key = (y_domain, asx.scale, asy.scale, self.fig.precision)
+        cache = data._table_cache
+        if cache is not None and cache[0] is data.dx and cache[1] is data.dy and cache[2] == key:
+            return cache[3]
+
+        # drop the samples outside the y domain here, this was done by pgfplots ('restrict y to domain') before,
+        # which is slow for large tables, and the dropped samples do not have to be written at all
+        # the values are scaled here as well, an 'x expr' would make pgfplots evaluate the product for every row
+        dx = data.dx * asx.scale if asx.scale != 1 else data.dx
+        dy = data.dy * asy.scale if asy.scale != 1 else data.dy
         if y_domain is not None:
-            params_plot += [f'restrict y to domain={{{self.__fmt_flt(y_domain[0])}:{self.__fmt_flt(y_domain[1])}}}']
-
-        asx = cast(AxisSetup, self.fig.axes[ax])
-        asy = cast(AxisSetup, self.fig.axes[ay])
-        params_table = [
-            f'row sep=newline',
-            f'x expr=\\thisrowno{{0}}*{self.__fmt_flt(asx.scale)}',
-            f'y expr=\\thisrowno{{1}}*{self.__fmt_flt(asy.scale)}',
-        ]
-        out = [r'\addplot [']
-        out += [f'  {p},' for p in params_plot]
-        out += [r'] table [']
-        out += [f'  {p},' for p in params_table]
-        out += [r']{']
-        for x, y in zip(data.dx, data.dy):
-            out.append(f'  {self.__fmt_flt(x)} {self.__fmt_flt(y)}')
-        out += [r'};']
-        out += [f'\\label{{dplot:{data._id}}}']
-        return out
+            mask = (dy >= y_domain[0]) & (dy <= y_domain[1])
+            if not mask.all():
+                dx, dy = dx[mask], dy[mask]
+
+        table = self.__fmt_table(dx, dy)
+        data._table_cache = (data.dx, data.dy, key, table)
+        return table
 
     def __create_plot_end(self) -> list[str]:
         return [r'\end{axis}']
 
     def __create_overlay(self) -> list[str]:
         out = ['']
-        out += ['%%%%%%%%%%%']
-        out += ['% overlay %']
-        out += ['%%%%%%%%%%%']
-        for axis, axis_setup in self.fig.axes.items():
-            if axis_setup is not None:
-                axis_kind = Figure.get_axis_kind(axis)
-                axis_kind_op = Figure.get_opposite_axis_kind(axis_kind)
-                params = self.__get_axis_param(axis_kind, axis_setup)
-                params += [
-                    f'{axis_kind_op}min=0',
-                    f'{axis_kind_op}max=1',
-                    f'{axis_kind}mode=' + ('log' if axis_setup.log else 'linear'),
-                    f'log basis {axis_kind}={axis_setup.log_base}',
-                    f'{axis_kind}tick style={{draw=none}}',
-                    f'{axis_kind}tick distance=' + (self.__fmt_flt(axis_setup.tick.major_distance) if axis_setup.tick.major_distance is not None else r''),
-                    f'hide {axis_kind_op} axis=true',
-                    f'{axis_kind}ticklabel pos={Figure.get_axis_pos(axis)}',
-                    r'axis on top=true',
-                ]
-
-                out += [r'\begin{axis}% ' + f'{axis}-axis', r'['] + [f'  {p},' for p in params] + [r']', r'\end{axis}']
+        out.append('%%%%%%%%%%%')
+        out.append('% overlay %')
+        out.append('%%%%%%%%%%%')
+        for axis, axis_setup, axis_kind, axis_kind_op in self.__used_axes:
+            params = self.__get_axis_param(axis_kind, axis_setup)
+            params += [
+                f'{axis_kind_op}min=0',
+                f'{axis_kind_op}max=1',
+                f'{axis_kind}mode=' + ('log' if axis_setup.log else 'linear'),
+                f'log basis {axis_kind}={axis_setup.log_base}',
+                f'{axis_kind}tick style={{draw=none}}',
+                f'{axis_kind}tick distance=' + (self.__fmt_flt(axis_setup.tick.major_distance) if axis_setup.tick.major_distance is not None else r''),
+                f'hide {axis_kind_op} axis=true',
+                f'{axis_kind}ticklabel pos={Figure.get_axis_pos(axis)}',
+                r'axis on top=true',
+            ]
+
+            out.append(self.__fmt_axis_block(f'{axis}-axis', params))
         return out
 
     def __create_legend(self) -> list[str]:
         out = ['']
-        out += ['%%%%%%%%%%']
-        out += ['% legend %']
-        out += ['%%%%%%%%%%']
+        out.append('%%%%%%%%%%')
+        out.append('% legend %')
+        out.append('%%%%%%%%%%')
         legend_style = [
             f'at={{({self.__fmt_flt(self.fig.legend_setup.at[0])},{self.__fmt_flt(self.fig.legend_setup.at[1])})}}',
             f'anchor={self.fig.legend_setup.anchor}',
@@ -648,16 +932,11 @@ class _LatexOutput:
             r'axis on top=true',
             r'legend style={' + ', '.join(legend_style) + r'}'
         ]
-        out += [
-            r'\begin{axis}',
-            r'['
-        ]
-        out += [f'  {p},' for p in params]
-        out += [r']']
+        out.extend([r'\begin{axis}', r'[', self.__fmt_params(params), r']'])
         for data in self.fig.plot_data:
             label = data.label if len(data.label) > 0 else str(data._id)
             out.append(r'\addlegendimage{/pgfplots/refstyle=dplot:' + str(data._id) + r'}\addlegendentry{' + label + r'}')
-        out += [r'\end{axis}']
+        out.append(r'\end{axis}')
         return out
 
     def __create_doc_end(self) -> list[str]:
@@ -672,6 +951,11 @@ class _MatplotlibView:
         self.fig = fig
 
     def show(self):
+        # matplotlib is only imported on demand, it is not required for the latex export
+        # import matplotlib
+        # matplotlib.use('gtk3agg')
+        import matplotlib.pyplot as plt
+
         custom_params = {
             'text.usetex': True,
             'font.family': 'serif',
@@ -684,7 +968,9 @@ class _MatplotlibView:
             self._show_pyplot()
 
     def _show_pyplot(self):
-        plt_fig, plot_initial = plt.subplots(figsize=(10, 6))
+        import matplotlib.pyplot as plt
+
+        plt_fig, plot_initial = plt.subplots(figsize=(10, 6), layout='constrained')  # cheaper than tight_layout
         plt.get_current_fig_manager().set_window_title(self.fig.title if len(self.fig.title) > 0 else self.fig.name)
 
         required_axes = {axis: axis_setup for axis, axis_setup in self.fig.axes.items() if axis_setup is not None}
@@ -735,7 +1021,6 @@ class _MatplotlibView:
         if self.fig.legend_setup.enable:
             plot_initial.legend()
 
-        plt.tight_layout()
         plt.show(block=True)
 
         # plot_initial.tick_params(axis='y', colors='blue')
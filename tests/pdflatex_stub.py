@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# stands in for pdflatex in the tests, appends its command line to the file $PDFLATEX_STUB_CALLS
+# like pdflatex it asks for a rerun if the document has labels but no aux file exists yet, in draft mode no pdf is written
+# -ini writes the format <jobname>.fmt unless $PDFLATEX_STUB_NO_FORMAT is set, -fmt=<name> fails if it is not found via $TEXFORMATS
+import os.path
+import sys
+
+with open(os.environ['PDFLATEX_STUB_CALLS'], 'a') as fp:
+    fp.write(' '.join(sys.argv[1:]) + '\n')
+
+if '-ini' in sys.argv:
+    if 'PDFLATEX_STUB_NO_FORMAT' not in os.environ:
+        job = next(arg[len('-jobname='):] for arg in sys.argv if arg.startswith('-jobname='))
+        open(job + '.fmt', 'w').close()
+    sys.exit()
+for arg in sys.argv:
+    if arg.startswith('-fmt='):
+        dirs = [d for d in os.environ.get('TEXFORMATS', '').split(os.pathsep) if d]
+        if not any(os.path.exists(os.path.join(d, arg[len('-fmt='):] + '.fmt')) for d in dirs):
+            sys.exit(1)
+
+path_tex = sys.argv[-1]
+job = os.path.splitext(os.path.basename(path_tex))[0]
+with open(path_tex) as fp:
+    has_labels = r'\label{' in fp.read()
+with open(job + '.log', 'w') as fp:
+    if has_labels and not os.path.exists(job + '.aux'):
+        fp.write('LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.\n')
+open(job + '.aux', 'w').close()
+if '-draftmode' not in sys.argv:
+    with open(job + '.pdf', 'w') as fp:
+        fp.write('%PDF-1.5\n')
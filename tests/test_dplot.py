@@ -1,23 +1,28 @@
-import inspect
 import os.path
-import unittest
-from typing import cast
+import sys
+from typing import Union
 import numpy as np
-from numpy import pi
 import pandas
+import pytest
 from pandas import DataFrame
-from dplot import *
+import dplot
+from dplot import Figure, Data, AxisSetup, TickSetup, GridSetup, LineSetup, LegendSetup, ExportType
 from tests.tools import check_identical_pdf
 
-PATH_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'out')
+PATH_TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PATH_OUTPUT_DIR = os.path.join(PATH_TESTS_DIR, 'out')
+PATH_S_PAR_DATA = os.path.join(PATH_TESTS_DIR, 'via250.txt')
+PATH_PDFLATEX_STUB = os.path.join(PATH_TESTS_DIR, 'pdflatex_stub.py')
+
+# shared setups, dplot only reads tick setups, so they can be used by several axes and tests
+TICK_SETUP_ENABLED = TickSetup(enable=True)
 
 
 def test_classic_bl():
-    title = inspect.stack()[0][3]
+    title = sys._getframe().f_code.co_name
     fig = Figure(title, background_color='gray!30', legend_setup=LegendSetup(enable=False))
-    ts = TickSetup(enable=True)
-    fig.axes['b'] = AxisSetup('x', scale=1, tick=ts)
-    fig.axes['l'] = AxisSetup('y', scale=1, tick=ts)
+    fig.axes['b'] = AxisSetup('x', scale=1, tick=TICK_SETUP_ENABLED)
+    fig.axes['l'] = AxisSetup('y', scale=1, tick=TICK_SETUP_ENABLED)
     fig.add(Data('b', 'l', [-2, -1, 0, 1, 2], [5, 1, 0, 1, 5]))
 
     path_pdf, = fig.export(PATH_OUTPUT_DIR, ExportType.PDF)
@@ -25,14 +30,14 @@ def test_classic_bl():
 
 
 def test_all_axes():
-    title = inspect.stack()[0][3]
+    title = sys._getframe().f_code.co_name
     fig = Figure(title, background_color='gray!30', legend_setup=LegendSetup(enable=False))
     fig.axes['b'] = AxisSetup(
         'bottom', scale=1,
         tick=TickSetup(enable=True, minor_thickness='very thin', major_thickness='very thick', minor_color='blue', minor_num=4),
         grid=GridSetup(major_enable=True, major_thickness='very thick', minor_enable=True, minor_color='blue', minor_thickness='thin'))
-    fig.axes['l'] = AxisSetup('left', log=True, tick=TickSetup(enable=True))
-    fig.axes['r'] = AxisSetup('right', tick=TickSetup(enable=True))
+    fig.axes['l'] = AxisSetup('left', log=True, tick=TICK_SETUP_ENABLED)
+    fig.axes['r'] = AxisSetup('right', tick=TICK_SETUP_ENABLED)
     fig.axes['t'] = AxisSetup(
         'top', scale=1,
         tick=TickSetup(enable=True, minor_thickness='thin', major_thickness='thick', minor_num=1),
@@ -49,11 +54,14 @@ def test_all_axes():
 
 
 def test_s_par():
-    title = inspect.stack()[0][3]
-    path = os.path.join(os.path.dirname(__file__), 'via250.txt')
-    df: DataFrame = pandas.read_csv(path, delimiter='\t')
-    freqs_ghz = df['S(1,1) (GHz) Via Frequency'].to_numpy()
-    s11 = df['S(1,1) Via Unitless data (Real)'].to_numpy() + 1j * df['S(1,1) Via Unitless data (Imag)'].to_numpy()
+    title = sys._getframe().f_code.co_name
+    cols = ['S(1,1) (GHz) Via Frequency', 'S(1,1) Via Unitless data (Real)', 'S(1,1) Via Unitless data (Imag)']
+    df: DataFrame = pandas.read_csv(PATH_S_PAR_DATA, delimiter='\t', usecols=cols, dtype={c: np.float64 for c in cols}, engine='c')
+    freqs_ghz, s11_re, s11_im = (df[c].to_numpy() for c in cols)
+    # no complex array required: 10^2 * 20 * log10(|S|) = 10^3 * log10(|S|^2)
+    s11_mag = 1000.0 * np.log10(np.square(s11_re) + np.square(s11_im))
+    s11_ang = np.arctan2(s11_im, s11_re)
+    s11_ang *= 360 / np.pi  # in-place, the constant is folded
 
     fig = Figure(title, legend_setup=LegendSetup(anchor='south east', at=(0.6, 0.02)))
     fig.axes['t'] = AxisSetup(padding='0cm')
@@ -62,9 +70,9 @@ def test_s_par():
     fig.axes['l'] = AxisSetup(r'$|S| \cdot 10^2$', label_shift='0.1em', padding='1.5cm')
     fig.axes['r'] = AxisSetup(r'$\angle S$ / $\num{360}^\circ$', label_shift='1.5em', padding='1.5cm')
 
-    fig.add(Data('b', 'l', freqs_ghz, 10 ** 2 * 20 * np.log10(np.abs(s11)), label=r'$|S_{11}|$',
+    fig.add(Data('b', 'l', freqs_ghz, s11_mag, label=r'$|S_{11}|$',
                  ls=LineSetup(marker='*', marker_repeat=20)))
-    fig.add(Data('b', 'r', freqs_ghz, cast(np.array, np.angle(s11)) * 360 / np.pi,
+    fig.add(Data('b', 'r', freqs_ghz, s11_ang,
                  ls=LineSetup(line_style='dashed', marker='*', marker_repeat=20), label=r'$\angle S_{11}$'))
 
     path_pdf, = fig.export(PATH_OUTPUT_DIR, ExportType.PDF)
@@ -78,18 +86,22 @@ def test_crlb():
     n_f0s = 51  # number of f0s for the plot
     f0_min = 0
     f0_max = 0.5
-    title = f'{inspect.stack()[0][3]}_{N}'
+    title = f'{sys._getframe().f_code.co_name}_{N}'
 
-    n = np.array(range(N))
+    n = np.arange(N, dtype=np.float64)
     f0s = np.linspace(f0_min, f0_max, n_f0s)
 
     # calculate the value in the sum of the denominator, i.e. for every f0 x n
-    # then sum over the n -> 2nd axis i.e. axis=1
+    # then sum over the n -> matrix-vector product with n^2, the phase matrix is transformed in-place
     # use np.clip to prevent dividing by zero
-    den = 2 * pi ** 2 * np.sum(n ** 2 - n ** 2 * np.cos(4 * pi * np.outer(f0s, n) + 2 * phi), axis=1)
+    n2 = n * n
+    phase = np.multiply.outer(f0s, 4 * np.pi * n)
+    phase += 2 * phi
+    np.cos(phase, out=phase)
+    den = 2 * np.pi ** 2 * (n2.sum() - phase @ n2)
     crlb_exact = 1 / np.clip(den, a_min=1e-100, a_max=None)
 
-    crlb_approx = 3 / (pi ** 2 * (N - 1) * N * (2 * N - 1))
+    crlb_approx = 3 / (np.pi ** 2 * (N - 1) * N * (2 * N - 1))
 
     crlb_min = np.min(crlb_exact)
     crlb_max = 2 * crlb_approx - crlb_min
@@ -99,12 +111,227 @@ def test_crlb():
     # print(f'{title}: y_min={y_min}, y_max={y_max} crlb_approx={crlb_approx}')
 
     fig = Figure(title, background_color='gray!30', legend_setup=LegendSetup(enable=True))
-    ts = TickSetup(enable=True)
-    fig.axes['b'] = AxisSetup(r'$f_0$', scale=1, tick=ts)
-    fig.axes['l'] = AxisSetup(r'$\mathrm{CRLB} \ /\  (\sigma^2 / A^2)$', scale=1, tick=ts, limits=(y_min, y_max), padding='1cm', log=True)
+    fig.axes['b'] = AxisSetup(r'$f_0$', scale=1, tick=TICK_SETUP_ENABLED)
+    fig.axes['l'] = AxisSetup(r'$\mathrm{CRLB} \ /\  (\sigma^2 / A^2)$', scale=1, tick=TICK_SETUP_ENABLED, limits=(y_min, y_max), padding='1cm', log=True)
     fig.axes['r'] = AxisSetup('', padding='1cm')
     fig.add(Data('b', 'l', f0s, crlb_exact, label='exact'))
     fig.add(Data('b', 'l', np.array([f0_min, f0_max]), np.ones(2) * crlb_approx, label='approx', ls=LineSetup(line_style='dotted')))
 
     path_pdf, = fig.export(PATH_OUTPUT_DIR, ExportType.PDF)
     assert check_identical_pdf(path_pdf)
+
+
+def create_figure(name: str, limits: Union[tuple[float, float], None] = None, **kwargs) -> Figure:
+    # figure without legend, with a bottom x and a left y axis, used by the tests of the generated latex code
+    fig = Figure(name, legend_setup=LegendSetup(enable=False), **kwargs)
+    fig.axes['b'] = AxisSetup('x', limits=limits)
+    fig.axes['l'] = AxisSetup('y', limits=limits)
+    return fig
+
+
+@pytest.fixture
+def pdflatex_calls(tmp_path, monkeypatch) -> str:
+    # replaces pdflatex by the stub, returns the path of the file with the command lines of all pdflatex runs
+    path_calls = str(tmp_path / 'pdflatex.calls')
+    open(path_calls, 'w').close()
+    monkeypatch.setattr(dplot.dplot.Environment, 'PATH_PDFLATEX', PATH_PDFLATEX_STUB)
+    monkeypatch.setenv('PDFLATEX_STUB_CALLS', path_calls)
+    return path_calls
+
+
+def read_lines(path: str) -> list[str]:
+    with open(path) as fp:
+        return fp.read().splitlines()
+
+
+def test_table_round_trip():
+    rng = np.random.default_rng(0)
+    dx = np.sort(rng.uniform(-1e3, 1e3, 100))
+    dy = rng.normal(0, 1e-7, 100)
+    fig = create_figure('table_round_trip')
+    fig.add(Data('b', 'l', dx, dy))
+
+    lines = fig.get_latex_code()
+    table = lines[lines.index(']{') + 1:lines.index('};')]
+    values = np.array([[float(v) for v in line.split()] for line in table])
+    assert np.array_equal(values[:, 0], dx)  # the written numbers must be exact, not just close
+    assert np.array_equal(values[:, 1], dy)
+
+
+def test_latex_cache_invalidation():
+    fig = create_figure('latex_cache_invalidation', limits=(0, 10))
+    y = np.array([1.0, 2.0])
+    data = Data('b', 'l', [1, 2], y)
+    fig.add(data)
+    code = fig.get_latex_code()
+
+    y[:] = 3  # the data set holds its own copy
+    assert fig.get_latex_code() == code
+    with pytest.raises(ValueError):
+        data.dy[:] = 3  # read-only, changes have to be made by reassignment
+    data.dy = [3, 3]
+    assert '  1.0 3.0' in fig.get_latex_code()
+
+    dplot.dplot.LatexCmdsAfterDocClass.append('% custom')
+    try:
+        assert '% custom' in fig.get_latex_code()
+    finally:
+        dplot.dplot.LatexCmdsAfterDocClass.pop()
+
+
+def test_auto_limits_negative():
+    fig = create_figure('auto_limits_negative')
+    fig.axes['b'] = AxisSetup('x', scale=-2)
+    fig.add(Data('b', 'l', [-3, -1], [-5, -2]))
+
+    lines = fig.get_latex_code()
+    # a negative scale swaps the bounds, negative data must not be limited by the initial value
+    assert '  xmin=2.0,' in lines
+    assert '  xmax=6.0,' in lines
+    assert '  ymin=-5.0,' in lines
+    assert '  ymax=-2.0,' in lines
+    # the table is written pre-scaled, pgfplots does not scale it again
+    assert lines[lines.index(']{') + 1:lines.index('};')] == ['  6.0 -5.0', '  2.0 -2.0']
+    assert not any('x expr' in line or 'y expr' in line for line in lines)
+
+
+def test_data_cache_reassignment():
+    data = Data('b', 'l', [1, 2], [1, 2])
+    for dy, row, limits in (([1, 2], '  2.0 2.0', (1.0, 2.0)), ([-4, 8], '  2.0 8.0', (-4.0, 8.0))):
+        data.dy = dy  # neither the table nor the value range cached for the previous figures must be reused
+        fig = create_figure('data_cache_fixed', limits=(-10, 10))
+        fig.add(data)
+        assert row in fig.get_latex_code()
+        fig = create_figure('data_cache_auto')
+        fig.add(data)
+        fig.get_latex_code()
+        assert fig.axes['l'].limits == limits
+    with pytest.raises(ValueError):
+        data.dy[0] = 100  # in-place changes are not possible
+
+
+def test_auto_limits_nan():
+    fig = create_figure('auto_limits_nan')
+    fig.add(Data('b', 'l', [1, 2, 3], [np.nan, 4, 2]))
+    fig.add(Data('b', 'l', [5, 6], [np.nan, np.nan]))  # no valid sample, does not contribute
+
+    lines = fig.get_latex_code()
+    assert '  xmin=1.0,' in lines
+    assert '  xmax=6.0,' in lines
+    assert '  ymin=2.0,' in lines
+    assert '  ymax=4.0,' in lines
+
+
+def test_precision():
+    fig = create_figure('precision', limits=(0, 1), precision=4)
+    fig.add(Data('b', 'l', [1 / 3, 0.5], [3e-9, 2 / 3]))
+
+    lines = fig.get_latex_code()
+    assert '  0.3333 3e-09' in lines
+    assert '  0.5 0.6667' in lines
+    fig.precision = None  # lossless again, the cached table must not be reused
+    assert f'  {1 / 3!r} 3e-09' in fig.get_latex_code()
+    for precision in (0, -1, 2.5):
+        fig.precision = precision
+        with pytest.raises(AssertionError):
+            fig.get_latex_code()
+
+
+def test_data_reassignment_checks():
+    data = Data('b', 'l', [1, 2, 3], [1, 2, 3])
+    with pytest.raises(AssertionError):
+        data.dx = [[1, 2], [3, 4]]  # only one dimensional data
+
+    fig = create_figure('data_reassignment_checks')
+    fig.add(data)
+    data.dy = [1, 2]
+    with pytest.raises(AssertionError):
+        fig.get_latex_code()  # x and y data of different length
+
+
+def test_pdflatex_runs(pdflatex_calls, tmp_path):
+    fig = create_figure('pdflatex_runs')
+    fig.add(Data('b', 'l', [1, 2], [1, 2]))
+    fig.export(tmp_path / 'no_legend', ExportType.PDF)
+    assert len(read_lines(pdflatex_calls)) == 1  # no labels, nothing to resolve by a 2nd run
+
+    open(pdflatex_calls, 'w').close()
+    fig.legend_setup = LegendSetup(enable=True)
+    fig.export(tmp_path / 'legend', ExportType.PDF)
+    runs = read_lines(pdflatex_calls)
+    assert len(runs) == 2  # the legend references the plots via labels
+    assert '-draftmode' in runs[0].split()
+    assert '-draftmode' not in runs[1].split()
+
+
+def test_export_up_to_date(pdflatex_calls, tmp_path):
+    os.makedirs(tmp_path / 'sub')
+    fig = create_figure('sub/export_up_to_date', limits=(0, 10))
+    data = Data('b', 'l', [1, 2], [1, 2])
+    fig.add(data)
+    path_latex, = fig.export(tmp_path, ExportType.LATEX)
+    assert os.path.exists(tmp_path / 'sub' / '.dplot_cache_export_up_to_date.sha256')
+    os.utime(path_latex, ns=(0, 0))
+    fig.export(tmp_path, ExportType.LATEX)
+    assert os.stat(path_latex).st_mtime_ns == 0  # unchanged figure, the file is not written again
+
+    data.dy = [3, 4]
+    fig.export(tmp_path, ExportType.LATEX)
+    assert os.stat(path_latex).st_mtime_ns != 0
+    assert '  2.0 4.0' in read_lines(path_latex)
+
+    fig.export(tmp_path, ExportType.LATEX, ExportType.PDF)
+    fig.export(tmp_path, ExportType.PDF)  # up to date, but the latex file was not requested this time
+    assert not os.path.exists(path_latex)
+    assert len(read_lines(pdflatex_calls)) == 1
+
+
+def test_y_domain():
+    fig = create_figure('y_domain', limits=(1, 10))  # y domain 1e-10...1e11, see _LatexOutput.overscale_limit
+    fig.add(Data('b', 'l', [1, 2, 3, 4, 5], [2, 1e12, np.nan, -1, 1e11]))
+
+    lines = fig.get_latex_code()
+    table = lines[lines.index(']{') + 1:lines.index('};')]
+    # outliers and nan samples are dropped, pgfplots would discard them as well ('restrict y to domain')
+    assert table == ['  1.0 2.0', '  5.0 100000000000.0']
+    assert not any('restrict y to domain' in line for line in lines)
+
+    fig.axes['l'] = AxisSetup('y', limits=(1, 10), log=True)  # no y domain for logarithmic axes
+    lines = fig.get_latex_code()
+    assert len(lines[lines.index(']{') + 1:lines.index('};')]) == 5
+
+
+def test_precompile_preamble(pdflatex_calls, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(dplot.dplot.Environment, 'PRECOMPILE_PREAMBLE', True)
+    monkeypatch.setattr(dplot.dplot, '_preamble_formats', {})
+    os.makedirs(tmp_path / 'formats')
+    monkeypatch.setattr(dplot.dplot, '_format_dir', str(tmp_path / 'formats'))
+    fig = create_figure('precompile_preamble', limits=(0, 10))
+    data = Data('b', 'l', [1, 2], [1, 2])
+    fig.add(data)
+
+    path_latex, _ = fig.export(tmp_path, ExportType.LATEX, ExportType.PDF)
+    assert dplot.dplot.LatexCmdEndOfDump in read_lines(path_latex)
+    ini, run = [line.split() for line in read_lines(pdflatex_calls)]
+    assert ini[0] == '-ini'
+    assert ini[-3:-1] == ['&pdflatex', 'mylatexformat.ltx']
+    name = os.path.splitext(ini[-1])[0]
+    assert f'-jobname={name}' in ini
+    assert f'-fmt={name}' in run  # the stub fails unless the format is found via TEXFORMATS
+
+    data.dy = [3, 4]
+    fig.export(tmp_path, ExportType.PDF)  # the format is compiled once per process
+    assert len(read_lines(pdflatex_calls)) == 3
+
+    # fallback to the regular format if the preamble cannot be precompiled
+    open(pdflatex_calls, 'w').close()
+    monkeypatch.setattr(dplot.dplot, '_preamble_formats', {})
+    monkeypatch.setenv('PDFLATEX_STUB_NO_FORMAT', '1')
+    os.makedirs(tmp_path / 'formats_failed')
+    monkeypatch.setattr(dplot.dplot, '_format_dir', str(tmp_path / 'formats_failed'))
+    data.dy = [5, 6]
+    fig.export(tmp_path, ExportType.PDF)
+    ini, run = [line.split() for line in read_lines(pdflatex_calls)]
+    assert '-ini' in ini
+    assert not any(arg.startswith('-fmt=') for arg in run)
+    assert 'preamble could not be precompiled' in capsys.readouterr().err
@@ -1,10 +1,11 @@
-import cv2
+import filecmp
 import os.path
 import subprocess
+from typing import Union
 import numpy as np
+from PIL import Image
 
-# apt: sudo apt install python3-opencv
-# pip: pip3 install opencv-python
+# pip: pip3 install pillow
 
 
 def render_pdf_to_png(path_pdf: str, path_png: str, dpi: int = 300):
@@ -12,11 +13,40 @@ def render_pdf_to_png(path_pdf: str, path_png: str, dpi: int = 300):
     subprocess.call(cmd)
 
 
+def read_image(path: str) -> Union[np.ndarray, None]:
+    # like cv2.imread: 3 channels without alpha, None if the file cannot be read
+    try:
+        with Image.open(path) as img:
+            return np.asarray(img.convert('RGB'))
+    except OSError:
+        return None
+
+
+_reference_images: dict[tuple[str, int], Union[np.ndarray, None]] = {}
+
+
+def load_reference_image(path: str) -> Union[np.ndarray, None]:
+    # reference images are decoded once per session, a modified file is decoded again
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    img = _reference_images.get(key)
+    if img is None:
+        img = read_image(path)
+        _reference_images[key] = img
+    return img
+
+
 def check_images_are_identical(path_a: str, path_b: str) -> bool:
-    img_a = cv2.imread(path_a)
-    img_b = cv2.imread(path_b)
-    difference = cv2.subtract(img_a, img_b)
-    return not np.any(difference)
+    """
+    :param path_a: rendered image
+    :param path_b: reference image
+    """
+    if filecmp.cmp(path_a, path_b, shallow=False):  # identical files, no decoding required
+        return True
+    img_a = read_image(path_a)
+    img_b = load_reference_image(path_b)
+    if img_a is None or img_b is None or img_a.shape != img_b.shape:  # unreadable or differently sized
+        return False
+    return np.array_equal(img_a, img_b)
 
 
 def check_identical_pdf(path_pdf: str) -> bool: